@@ -1,10 +1,25 @@
 # main.py - AI Service Updates
 import os
-import requests
+import re
+import asyncio
+import time
+import hashlib
+from contextlib import asynccontextmanager
+from itertools import chain, islice
+from collections import defaultdict
+import httpx
+import orjson
+import numpy as np
+from tokenizers import Tokenizer
+from cachetools import TTLCache
+import redis.asyncio as redis
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, stop_after_delay, wait_exponential, wait_random
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing_extensions import TypedDict
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import AsyncIterator, List, Optional
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,55 +30,764 @@ if not HF_API_TOKEN:
     raise ValueError("Hugging Face API token not found. Please set HF_API_TOKEN in your .env file.")
 
 API_URL_SUMMARIZE = "https://api-inference.huggingface.co/models/philschmid/bart-large-cnn-samsum"
-API_URL_CHAT = "https://api-inference.huggingface.co/models/HuggingFaceH4/zephyr-7b-beta"
+API_URL_CHAT_HF = "https://api-inference.huggingface.co/models/HuggingFaceH4/zephyr-7b-beta"
+# Optional self-hosted OpenAI-compatible completions endpoint (vLLM or TGI), e.g. http://vllm:8000/v1/completions.
+# Run vLLM with `--max-num-seqs 64 --enable-chunked-prefill` so concurrent requests share forward passes.
+CHAT_BACKEND_URL = os.getenv("CHAT_BACKEND_URL")
+CHAT_BACKEND_MODEL = os.getenv("CHAT_BACKEND_MODEL", "HuggingFaceH4/zephyr-7b-beta")
+CHAT_BACKEND_API_KEY = os.getenv("CHAT_BACKEND_API_KEY")
+API_URL_CHAT = CHAT_BACKEND_URL or API_URL_CHAT_HF
+API_URL_EMBED = "https://api-inference.huggingface.co/pipeline/feature-extraction/sentence-transformers/all-MiniLM-L6-v2"
 HEADERS = {"Authorization": f"Bearer {HF_API_TOKEN}"}
 
+# Summarization input limit: BART's 1024-token context minus the <s> and </s> special tokens
+SUMMARIZE_TOKENIZER = "facebook/bart-large-cnn"
+# Optional local tokenizer.json, so truncation works without reaching the Hugging Face Hub
+SUMMARIZE_TOKENIZER_PATH = os.getenv("SUMMARIZE_TOKENIZER_PATH")
+MAX_SUMMARIZE_INPUT_TOKENS = 1022
+TOKENIZER_RETRY_INTERVAL = 300  # Seconds to wait before retrying a failed tokenizer load
+
+# Upper bound on max_suggestions; generated replies are parsed up to this many so cached
+# entries can also serve requests asking for more suggestions
+MAX_SUGGESTIONS = 5
+
+# Number of recent messages used as smart-reply context
+MAX_CONTEXT_MESSAGES = 10
+
+# Retries and circuit breaking for transient backend failures
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_ATTEMPTS = 4
+MAX_RETRY_WAIT = 20  # Upper bound in seconds when honouring estimated_time / Retry-After
+MAX_RETRY_DELAY = 45  # No new attempt is started once this many seconds have passed
+CIRCUIT_FAIL_MAX = 10
+CIRCUIT_RESET_TIMEOUT = 30
+
+# Generation parameters
+CHAT_PARAMETERS = {
+    "max_new_tokens": 150,
+    "return_full_text": False, # We only want the new reply
+    "temperature": 0.7,
+    "top_p": 0.95
+}
+SMART_REPLY_PARAMETERS = {
+    "max_new_tokens": 100,
+    "return_full_text": False,
+    "temperature": 0.8,
+    "top_p": 0.9,
+    "do_sample": True
+}
+
+# Cache of Hugging Face responses for identical requests (summaries and chat replies)
+RESPONSE_CACHE = TTLCache(maxsize=10_000, ttl=86400)
+
+# Chat history per conversation_id. This is conversation state, not a cache: set REDIS_URL so
+# every worker sees the same history; without it history lives in the process and the service
+# must run a single worker. Keeping the prefix byte-identical across turns also lets a
+# self-hosted backend started with `--enable-prefix-caching` reuse its KV cache.
+REDIS_URL = os.getenv("REDIS_URL")
+MAX_HISTORY_TURNS = 10  # Older turns are dropped so the prompt stays within the model context
+CONVERSATION_TTL = 3600
+
+# Semantic cache settings for smart replies. Embeddings come from the Inference API rather than a
+# local model (keeping torch out of the service), so each smart-reply request costs one extra,
+# best-effort HF call: it is made once without retries, skipped while its circuit is open, and can
+# be turned off with SEMANTIC_CACHE_ENABLED=false when rate limits matter more than hit rate.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = 0.85
+SEMANTIC_CACHE_MAX_ENTRIES = 10_000
+SEMANTIC_CACHE_TURNS = 3  # How many recent messages are blended into the context embedding
+
+# Leading list markers ("1.", "-", "*", "•") stripped from generated suggestions, including stacked ones like "1. -"
+_PREFIX_RE = re.compile(r'^\s*(?:(?:\d+\.|[-*•])\s*)+')
+# Exclusive bounds on the length of a usable suggestion
+_MIN_SUGGESTION_LENGTH = 3
+_MAX_SUGGESTION_LENGTH = 100
+
+# Context-aware fallback suggestions, keyed by the category of the last message
+FALLBACKS_BY_CATEGORY = {
+    "question": ("Thanks for asking!", "Let me think about that", "Good question!"),
+    "thanks": ("You're welcome!", "No problem!", "Happy to help!"),
+    "meeting": ("Sounds good!", "I'll be there", "What time works?"),
+    "other": ("Got it!", "Makes sense", "Thanks for the update"),
+    "no_messages": ("Hi there!", "Thanks!", "Sounds good!"),
+}
+_FALLBACK_KEYWORD_RE = re.compile(r"\?|thanks|thank you|meeting")
+_FALLBACK_KEYWORD_CATEGORIES = {"?": "question", "thanks": "thanks", "thank you": "thanks", "meeting": "meeting"}
+_FALLBACK_CATEGORY_PRIORITY = ("question", "thanks", "meeting")
+
+# Micro-batching of generation requests into one call with a list of inputs. Off by default:
+# - the hosted Inference API serves zephyr-7b-beta with TGI, whose "inputs" must be a single string;
+# - OpenAI-compatible completions servers (vLLM) accept a list "prompt", but batch continuously on their own.
+# Only raise CHAT_MAX_BATCH for a backend known to accept list inputs (e.g. a transformers
+# text-generation pipeline endpoint). A batch rejected for its shape (4xx) is re-sent one payload
+# at a time; transient and circuit-open errors are returned to every caller in the batch.
+MAX_BATCH = int(os.getenv("CHAT_MAX_BATCH", "1"))
+MAX_DELAY_MS = 20
+
 # --- Pydantic Models ---
 class SummarizeRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     text: str = Field(..., min_length=50)
 
 class SummarizeResponse(BaseModel):
     summary: str
 
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
     past_user_inputs: List[str] = Field(default_factory=list)
     generated_responses: List[str] = Field(default_factory=list)
     text: str = Field(...)
+    conversation_id: Optional[str] = Field(default=None, description="Lets the service keep the history so only the new turn needs to be sent")
 
 class ChatResponse(BaseModel):
     reply: str
 
+class Message(TypedDict):
+    author: str
+    content: str
+
 class SmartReplyRequest(BaseModel):
-    recent_messages: List[Dict[str, str]] = Field(..., description="List of recent messages with 'author' and 'content' keys")
+    model_config = ConfigDict(frozen=True, extra='ignore')
+
+    recent_messages: List[Message] = Field(..., description="List of recent messages with 'author' and 'content' keys")
     current_user: str = Field(..., description="Name of the current user")
-    max_suggestions: int = Field(default=3, ge=1, le=5)
+    conversation_id: Optional[str] = Field(default=None, description="Scopes cached suggestions to this conversation; without it the semantic cache is skipped")
+    max_suggestions: int = Field(default=3, ge=1, le=MAX_SUGGESTIONS)
+
+    @field_validator("recent_messages", mode="before")
+    @classmethod
+    def keep_recent_context(cls, value):
+        # Only the last messages are used, so skip validating the rest
+        return value[-MAX_CONTEXT_MESSAGES:] if isinstance(value, list) else value
 
 class SmartReplyResponse(BaseModel):
     suggestions: List[str] = Field(..., description="List of suggested replies")
 
 # --- FastAPI Application ---
+# Shared async HTTP client, created on startup so connections are reused across requests
+http_client: httpx.AsyncClient = None
+# Tokenizer used to cap summarization input, loaded in the background so only /summarize depends on it
+summarize_tokenizer: Optional[Tokenizer] = None
+_tokenizer_task: Optional[asyncio.Task] = None
+_tokenizer_retry_at = 0.0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    http_client = httpx.AsyncClient(
+        headers={"Content-Type": "application/json"},
+        timeout=30,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    )
+    CHAT_BATCHER.start()
+    SMART_REPLY_BATCHER.start()
+    try:
+        yield
+    finally:
+        await CHAT_BATCHER.stop()
+        await SMART_REPLY_BATCHER.stop()
+        await http_client.aclose()
+        await CONVERSATION_STORE.close()
+
 app = FastAPI(
     title="Chat Application AI Service",
     description="A microservice to handle AI tasks.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+# --- Semantic Cache ---
+class SemanticCache:
+    """
+    Stores values by normalized embedding and owner in a fixed-size ring buffer, and returns
+    the stored value for the same owner whose embedding has the highest cosine similarity
+    above the threshold. Once full, each insert overwrites the oldest entry.
+    """
+    def __init__(self, threshold: float, max_entries: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vectors: Optional[np.ndarray] = None  # Allocated on first insert, once the dimension is known
+        self.owners = np.empty(max_entries, dtype=object)
+        self.sizes = np.zeros(max_entries, dtype=np.int64)
+        self.values: List[Optional[List[str]]] = [None] * max_entries
+        self.count = 0
+        self.next_index = 0
+
+    def lookup(self, vector: np.ndarray, owner: str, min_size: int) -> Optional[List[str]]:
+        if self.count == 0:
+            return None
+        scores = self.vectors[:self.count] @ vector
+        eligible = (self.owners[:self.count] == owner) & (self.sizes[:self.count] >= min_size)
+        scores = np.where(eligible, scores, -np.inf)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return self.values[best]
+        return None
+
+    def add(self, vector: np.ndarray, owner: str, value: List[str]):
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+        index = self.next_index
+        self.vectors[index] = vector
+        self.owners[index] = owner
+        self.sizes[index] = len(value)
+        self.values[index] = value
+        self.next_index = (index + 1) % self.max_entries
+        self.count = min(self.count + 1, self.max_entries)
+
+SMART_REPLY_CACHE = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES)
+
+# --- Conversation History ---
+class ConversationStore:
+    """
+    Keeps the last MAX_HISTORY_TURNS rendered (user, assistant) turns per conversation_id,
+    in Redis when a URL is given and in process memory otherwise.
+    """
+    def __init__(self, redis_url: Optional[str]):
+        self.redis = redis.from_url(redis_url) if redis_url else None
+        self.local = TTLCache(maxsize=10_000, ttl=CONVERSATION_TTL)
+
+    async def get(self, conversation_id: str) -> List[str]:
+        if self.redis is not None:
+            turns = await self.redis.lrange(f"conversation:{conversation_id}", 0, -1)
+            return [turn.decode() for turn in turns]
+        return list(self.local.get(conversation_id, ()))
+
+    async def append(self, conversation_id: str, turn: str):
+        """
+        Adds one turn without rewriting the list, so overlapping turns on the same conversation are all kept.
+        """
+        if self.redis is not None:
+            key = f"conversation:{conversation_id}"
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.rpush(key, turn)
+                pipe.ltrim(key, -MAX_HISTORY_TURNS, -1)
+                pipe.expire(key, CONVERSATION_TTL)
+                await pipe.execute()
+        else:
+            # No await between the read and the write, so this cannot interleave with another turn
+            self.local[conversation_id] = (*self.local.get(conversation_id, ()), turn)[-MAX_HISTORY_TURNS:]
+
+    async def replace(self, conversation_id: str, turns: List[str]):
+        """
+        Overwrites the history, used when the client sent the full history itself.
+        """
+        turns = turns[-MAX_HISTORY_TURNS:]
+        if self.redis is not None:
+            key = f"conversation:{conversation_id}"
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                pipe.rpush(key, *turns)
+                pipe.expire(key, CONVERSATION_TTL)
+                await pipe.execute()
+        else:
+            self.local[conversation_id] = tuple(turns)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+
+CONVERSATION_STORE = ConversationStore(REDIS_URL)
+
+# --- Request Batching ---
+class InferenceBatcher:
+    """
+    Coalesces payloads submitted within MAX_DELAY_MS into a single Hugging Face
+    request whose "inputs" is a list. All payloads submitted to one batcher are
+    expected to share the same "parameters". If the backend rejects the shape of the batched
+    request, each payload is sent on its own instead.
+    """
+    def __init__(self, api_url: str, max_batch: int = MAX_BATCH, max_delay_ms: int = MAX_DELAY_MS):
+        self.api_url = api_url
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.in_flight = set()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        self.worker.cancel()
+        await asyncio.gather(self.worker, *self.in_flight, return_exceptions=True)
+
+    async def submit(self, payload: dict) -> list:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((payload, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next window can fill while this batch is in flight
+            task = asyncio.create_task(self._dispatch(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _dispatch(self, batch: list):
+        # Skip payloads whose caller has already given up (e.g. a smart-reply cache hit)
+        batch = [(payload, future) for payload, future in batch if not future.cancelled()]
+        if not batch:
+            return
+        if len(batch) > 1:
+            try:
+                results = await self._query_batch(batch)
+            except Exception as e:
+                if not is_schema_rejection(e):
+                    # Overload, outage or open circuit: re-sending per item would only add load
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    return
+                print(f"Batched request rejected, sending {len(batch)} payloads individually: {e}")
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+                return
+
+        await asyncio.gather(*(self._query_single(payload, future) for payload, future in batch))
+
+    async def _query_batch(self, batch: list) -> list:
+        batch_payload = {
+            "inputs": [payload["inputs"] for payload, _ in batch],
+            "parameters": batch[0][0].get("parameters", {}),
+        }
+        response_data = await query_huggingface(batch_payload, self.api_url)
+        if not isinstance(response_data, list) or len(response_data) != len(batch):
+            raise ValueError(f"Expected {len(batch)} results from batched request, got: {response_data}")
+        # Reshape each item to match the response of a single-input request
+        return [item if isinstance(item, list) else [item] for item in response_data]
+
+    async def _query_single(self, payload: dict, future: asyncio.Future):
+        # Abort the in-flight request if its caller gives up while it is running
+        request = asyncio.ensure_future(query_huggingface(payload, self.api_url))
+        future.add_done_callback(lambda f: request.cancel() if f.cancelled() else None)
+        try:
+            result = await request
+        except asyncio.CancelledError:
+            if future.cancelled():
+                return
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+def is_schema_rejection(error: Exception) -> bool:
+    """
+    True when the backend refused the shape of a batched request (a 4xx other than 429,
+    or a result count that does not match), as opposed to a transient or circuit failure.
+    """
+    if isinstance(error, ValueError):
+        return True
+    return isinstance(error, HTTPException) and 400 <= error.status_code < 500 and error.status_code != 429
+
+CHAT_BATCHER = InferenceBatcher(API_URL_CHAT)
+SMART_REPLY_BATCHER = InferenceBatcher(API_URL_CHAT)
+
 # --- Helper Function ---
-def query_huggingface(payload: dict, api_url: str) -> dict:
-    response = requests.post(api_url, headers=HEADERS, json=payload)
+def is_chat_backend(api_url: str) -> bool:
+    return CHAT_BACKEND_URL is not None and api_url == CHAT_BACKEND_URL
+
+def auth_headers(api_url: str) -> dict:
+    """
+    The HF token only goes to Hugging Face; a self-hosted backend gets its own optional key.
+    """
+    if is_chat_backend(api_url):
+        return {"Authorization": f"Bearer {CHAT_BACKEND_API_KEY}"} if CHAT_BACKEND_API_KEY else {}
+    return HEADERS
+
+def to_completion_request(payload: dict) -> dict:
+    """
+    Maps a Hugging Face text-generation payload to the OpenAI-compatible completions schema.
+    """
+    parameters = payload.get("parameters", {})
+    request = {
+        "model": CHAT_BACKEND_MODEL,
+        "prompt": payload["inputs"],
+        "max_tokens": parameters.get("max_new_tokens", 150),
+    }
+    for key in ("temperature", "top_p"):
+        if key in parameters:
+            request[key] = parameters[key]
+    return request
+
+def from_completion_response(response_data: dict, batched: bool) -> list:
+    """
+    Maps an OpenAI-compatible completions response back to the Hugging Face text-generation shape.
+    """
+    choices = sorted(response_data["choices"], key=lambda choice: choice["index"])
+    results = [{"generated_text": choice["text"]} for choice in choices]
+    return [[result] for result in results] if batched else results
+
+class TransientHFError(HTTPException):
+    """
+    A 429/5xx from the backend that is worth retrying. retry_after holds the
+    wait suggested by the backend (503 estimated_time or Retry-After), if any.
+    """
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(status_code=status_code, detail=detail)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Opens after fail_max consecutive failures and rejects calls until
+    reset_timeout seconds have passed, after which calls are let through again.
+    """
+    def __init__(self, fail_max: int, reset_timeout: float):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    def allow_request(self) -> bool:
+        return self.opened_at is None or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.fail_max:
+            self.opened_at = time.monotonic()
+
+CIRCUIT_BREAKERS = defaultdict(lambda: CircuitBreaker(CIRCUIT_FAIL_MAX, CIRCUIT_RESET_TIMEOUT))
+
+def check_circuit(api_url: str):
+    if not CIRCUIT_BREAKERS[api_url].allow_request():
+        raise HTTPException(status_code=503, detail=f"Circuit open for {api_url}, skipping call")
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    header = response.headers.get("Retry-After")
+    if header and header.isdigit():
+        return float(header)
+    try:
+        return float(orjson.loads(response.content).get("estimated_time"))
+    except Exception:
+        return None
+
+# Exponential backoff from 0.3s capped at 3s, plus up to 1s of jitter
+_backoff = wait_exponential(multiplier=0.3, max=3) + wait_random(0, 1)
+
+def wait_for_backend(retry_state) -> float:
+    # Prefer the wait suggested by the backend over blind exponential backoff
+    exception = retry_state.outcome.exception()
+    if isinstance(exception, TransientHFError) and exception.retry_after:
+        return min(exception.retry_after, MAX_RETRY_WAIT)
+    return _backoff(retry_state)
+
+async def post_once(request: dict, api_url: str) -> httpx.Response:
+    response = await http_client.post(api_url, headers=auth_headers(api_url), content=orjson.dumps(request))
+    if response.status_code in TRANSIENT_STATUS_CODES:
+        raise TransientHFError(
+            status_code=response.status_code,
+            detail=f"Error from Hugging Face API: {response.text}",
+            retry_after=retry_after_seconds(response),
+        )
+    return response
+
+# Only explicit 429/5xx responses are retried: timeouts and connection errors mean the backend
+# is stalled or unreachable, and retrying them would only pile more load onto it.
+post_with_retry = retry(
+    stop=stop_after_attempt(RETRY_ATTEMPTS) | stop_after_delay(MAX_RETRY_DELAY),
+    wait=wait_for_backend,
+    retry=retry_if_exception_type(TransientHFError),
+    reraise=True,
+)(post_once)
+
+async def query_huggingface(payload: dict, api_url: str, retry_transient: bool = True) -> dict:
+    use_completions = is_chat_backend(api_url)
+    request = to_completion_request(payload) if use_completions else payload
+
+    check_circuit(api_url)
+    post = post_with_retry if retry_transient else post_once
+    try:
+        response = await post(request, api_url)
+    except (TransientHFError, httpx.TransportError):
+        CIRCUIT_BREAKERS[api_url].record_failure()
+        raise
+    CIRCUIT_BREAKERS[api_url].record_success()
+
     if response.status_code != 200:
         raise HTTPException(
             status_code=response.status_code,
             detail=f"Error from Hugging Face API: {response.text}"
         )
-    return response.json()
+    response_data = orjson.loads(response.content)
+    if use_completions:
+        return from_completion_response(response_data, isinstance(payload["inputs"], list))
+    return response_data
+
+async def stream_huggingface(payload: dict, api_url: str) -> AsyncIterator[str]:
+    """
+    Streams generated text chunks from a text-generation endpoint that emits server-sent events.
+    """
+    use_completions = is_chat_backend(api_url)
+    request = to_completion_request(payload) if use_completions else payload
+
+    check_circuit(api_url)
+    breaker = CIRCUIT_BREAKERS[api_url]
+    try:
+        async with http_client.stream(
+            "POST", api_url, headers=auth_headers(api_url), content=orjson.dumps({**request, "stream": True})
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                error_class = TransientHFError if response.status_code in TRANSIENT_STATUS_CODES else HTTPException
+                raise error_class(
+                    status_code=response.status_code,
+                    detail=f"Error from Hugging Face API: {response.text}"
+                )
+            # Recorded as soon as the backend accepts the stream, since callers may stop reading early
+            breaker.record_success()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                event = orjson.loads(data)
+                if use_completions:
+                    text = event["choices"][0].get("text", "")
+                else:
+                    token = event.get("token", {})
+                    text = "" if token.get("special") else token.get("text", "")
+                if text:
+                    yield text
+    except (TransientHFError, httpx.TransportError):
+        breaker.record_failure()
+        raise
+
+def sse_event(data, event: Optional[str] = None) -> bytes:
+    prefix = f"event: {event}\n".encode() if event else b""
+    return prefix + b"data: " + orjson.dumps(data) + b"\n\n"
+
+async def cached_query_huggingface(payload: dict, api_url: str, batcher: Optional[InferenceBatcher] = None) -> dict:
+    """
+    Same as query_huggingface, but identical (url, payload) pairs are served from RESPONSE_CACHE.
+    Cache misses go through the batcher when one is given.
+    """
+    key = hashlib.sha256(api_url.encode() + orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    cached = RESPONSE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    if batcher is not None:
+        response_data = await batcher.submit(payload)
+    else:
+        response_data = await query_huggingface(payload, api_url)
+    return RESPONSE_CACHE.setdefault(key, response_data)
+
+async def embed_conversation(messages: List[Message]) -> Optional[np.ndarray]:
+    """
+    Embeds the most recent messages into a single normalized context vector.
+    The latest message carries a weight of 0.7; earlier messages share the rest,
+    halving with each step back. Returns None if the embedding call fails or its circuit is open.
+    """
+    turns = [f"{msg['author']}: {msg['content']}" for msg in messages[-SEMANTIC_CACHE_TURNS:]]
+    if not turns or not CIRCUIT_BREAKERS[API_URL_EMBED].allow_request():
+        return None
+    try:
+        response_data = await query_huggingface({"inputs": turns}, API_URL_EMBED, retry_transient=False)
+        vectors = np.asarray(response_data, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[0] != len(turns):
+            raise ValueError(f"Expected {len(turns)} embeddings, got shape {vectors.shape}")
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        if not np.all(norms > 0):
+            return None
+        vectors /= norms
+        if len(turns) == 1:
+            blended = vectors[0]
+        else:
+            decay = 0.5 ** np.arange(len(turns) - 1, 0, -1)
+            weights = np.append(0.3 * decay / decay.sum(), 0.7)
+            blended = weights @ vectors
+        norm = np.linalg.norm(blended)
+        if not norm > 0:
+            return None
+        return blended / norm
+    except Exception as e:
+        print(f"Embedding error: {e}")
+        return None
+
+def _is_reasonable_length(line: str) -> bool:
+    return _MIN_SUGGESTION_LENGTH < len(line) < _MAX_SUGGESTION_LENGTH
+
+def parse_suggestions(generated_text: str, max_suggestions: int) -> List[str]:
+    """
+    Splits generated text into lines, strips list markers and keeps up to
+    max_suggestions lines of reasonable length.
+    """
+    # Lazily cleaned so islice stops as soon as enough suggestions are found
+    strip_prefix = _PREFIX_RE.sub
+    lines = (strip_prefix('', line).strip() for line in generated_text.split('\n'))
+    return list(islice(filter(_is_reasonable_length, lines), max_suggestions))
+
+def fallback_suggestions(messages: List[Message]) -> tuple:
+    """
+    Picks canned suggestions from the keywords in the last message, scanned in a single pass.
+    """
+    if not messages:
+        return FALLBACKS_BY_CATEGORY["no_messages"]
+    found = {
+        _FALLBACK_KEYWORD_CATEGORIES[match.group()]
+        for match in _FALLBACK_KEYWORD_RE.finditer(messages[-1]['content'].lower())
+    }
+    for category in _FALLBACK_CATEGORY_PRIORITY:
+        if category in found:
+            return FALLBACKS_BY_CATEGORY[category]
+    return FALLBACKS_BY_CATEGORY["other"]
+
+def load_summarize_tokenizer() -> Tokenizer:
+    if SUMMARIZE_TOKENIZER_PATH:
+        return Tokenizer.from_file(SUMMARIZE_TOKENIZER_PATH)
+    return Tokenizer.from_pretrained(SUMMARIZE_TOKENIZER)
+
+async def _load_summarize_tokenizer():
+    global summarize_tokenizer, _tokenizer_retry_at
+    try:
+        summarize_tokenizer = await asyncio.to_thread(load_summarize_tokenizer)
+    except Exception as e:
+        print(f"Tokenizer load error, summarizing without truncation: {e}")
+        _tokenizer_retry_at = time.monotonic() + TOKENIZER_RETRY_INTERVAL
+
+def get_summarize_tokenizer() -> Optional[Tokenizer]:
+    """
+    Returns the summarization tokenizer once it is loaded, or None until then. The first call
+    starts loading it in a background task, which requests never wait on; a failed load is
+    retried after TOKENIZER_RETRY_INTERVAL.
+    """
+    global _tokenizer_task
+    if (
+        summarize_tokenizer is None
+        and (_tokenizer_task is None or _tokenizer_task.done())
+        and time.monotonic() >= _tokenizer_retry_at
+    ):
+        _tokenizer_task = asyncio.create_task(_load_summarize_tokenizer())
+    return summarize_tokenizer
+
+def truncate_to_token_limit(text: str, max_tokens: int, tokenizer: Optional[Tokenizer]) -> str:
+    """
+    Cuts text at the end of its max_tokens-th token so it fits the model context.
+    Without a tokenizer the text is passed through unchanged.
+    """
+    if tokenizer is None:
+        return text
+    encoding = tokenizer.encode(text, add_special_tokens=False)
+    if len(encoding.ids) <= max_tokens:
+        return text
+    return text[:encoding.offsets[max_tokens - 1][1]]
+
+def render_turn(user_input: str, assistant_response: str) -> str:
+    return f"<|user|>\n{user_input}</s>\n<|assistant|>\n{assistant_response}</s>"
+
+async def load_chat_history(payload: ChatRequest) -> List[str]:
+    """
+    Returns the rendered past turns: the ones sent by the client, or else the
+    stored history for a known conversation_id.
+    """
+    if payload.past_user_inputs:
+        # Capped like stored history so the prompt stays within the model context
+        turns = list(zip(payload.past_user_inputs, payload.generated_responses))[-MAX_HISTORY_TURNS:]
+        return [render_turn(user_input, assistant_response) for user_input, assistant_response in turns]
+    if payload.conversation_id:
+        return await CONVERSATION_STORE.get(payload.conversation_id)
+    return []
+
+async def save_chat_turn(payload: ChatRequest, history: List[str], reply: str):
+    """
+    Records the new turn for payload.conversation_id, if any. History sent by the client
+    replaces the stored one; otherwise only the new turn is appended.
+    """
+    if not payload.conversation_id:
+        return
+    turn = render_turn(payload.text, reply)
+    if payload.past_user_inputs:
+        await CONVERSATION_STORE.replace(payload.conversation_id, [*history, turn])
+    else:
+        await CONVERSATION_STORE.append(payload.conversation_id, turn)
+
+def build_chat_prompt(text: str, history: List[str]) -> str:
+    """
+    Builds a single prompt string with the correct chat template.
+    """
+    if not history:
+        # First turn, the most common shape: nothing to interleave
+        return f"<|user|>\n{text}</s>\n<|assistant|>"
+    # Past turns, then the latest user message and the token that prompts the assistant to start talking.
+    return "\n".join(chain(history, (f"<|user|>\n{text}</s>", "<|assistant|>")))
+
+def build_smart_reply_prompt(payload: SmartReplyRequest) -> str:
+    """
+    Creates the prompt for generating reply suggestions.
+    """
+    # Build conversation context (recent_messages is already capped to MAX_CONTEXT_MESSAGES)
+    conversation_context = "\n".join(f"{msg['author']}: {msg['content']}" for msg in payload.recent_messages)
+
+    return f"""<|user|>
+Based on this conversation, suggest 3 short, appropriate replies that {payload.current_user} could send. 
+Make them natural, contextual, and varied in tone (e.g., one professional, one casual, one question).
+Each reply should be on a new line and be concise (under 20 words).
+
+Conversation:
+{conversation_context}
+
+Generate 3 reply suggestions for {payload.current_user}:</s>
+<|assistant|>"""
+
+def semantic_cache_owner(payload: SmartReplyRequest) -> Optional[str]:
+    """
+    Cache entries belong to one user within one conversation. current_user is only a display
+    name, so without a conversation_id there is nothing to tell two people of the same name
+    apart and the request does not use the semantic cache.
+    """
+    if not payload.conversation_id:
+        return None
+    return f"{payload.conversation_id}\x00{payload.current_user}"
+
+async def semantic_cache_lookup(payload: SmartReplyRequest) -> tuple:
+    """
+    Returns (context_vector, cached_suggestions); either may be None. Only entries generated
+    for the same owner with at least max_suggestions replies count as hits.
+    """
+    owner = semantic_cache_owner(payload)
+    if not SEMANTIC_CACHE_ENABLED or owner is None:
+        return None, None
+    context_vector = await embed_conversation(payload.recent_messages)
+    if context_vector is None:
+        return None, None
+    return context_vector, SMART_REPLY_CACHE.lookup(context_vector, owner, payload.max_suggestions)
 
 # --- API Endpoints ---
 @app.post("/api/v1/summarize", response_model=SummarizeResponse, tags=["AI Features"])
 async def summarize(payload: SummarizeRequest):
     try:
-        response_data = query_huggingface(
-            {"inputs": payload.text, "parameters": {"min_length": 10, "max_length": 50}},
+        response_data = await cached_query_huggingface(
+            {
+                "inputs": truncate_to_token_limit(
+                    payload.text, MAX_SUMMARIZE_INPUT_TOKENS, get_summarize_tokenizer()
+                ),
+                "parameters": {"min_length": 10, "max_length": 50}
+            },
             API_URL_SUMMARIZE
         )
         summary = response_data[0].get("summary_text", "Sorry, I could not generate a summary.")
@@ -76,33 +800,14 @@ async def chat(payload: ChatRequest):
     """
     Generates a conversational reply using a single, formatted prompt string.
     """
-    # Build a single prompt string with the correct chat template.
-    prompt_parts = []
-    # Interleave past user inputs and generated responses
-    for user_input, assistant_response in zip(payload.past_user_inputs, payload.generated_responses):
-        prompt_parts.append(f"<|user|>\n{user_input}</s>")
-        prompt_parts.append(f"<|assistant|>\n{assistant_response}</s>")
-
-    # Add the latest user message
-    prompt_parts.append(f"<|user|>\n{payload.text}</s>")
-    # Add the token that prompts the assistant to start talking
-    prompt_parts.append("<|assistant|>")
-
-    # Join all parts into a single string
-    prompt = "\n".join(prompt_parts)
-
     try:
-        response_data = query_huggingface(
-            {
-                "inputs": prompt,
-                "parameters": {
-                    "max_new_tokens": 150,
-                    "return_full_text": False, # We only want the new reply
-                    "temperature": 0.7,
-                    "top_p": 0.95
-                }
-            },
-            API_URL_CHAT
+        history = await load_chat_history(payload)
+        prompt = build_chat_prompt(payload.text, history)
+
+        response_data = await cached_query_huggingface(
+            {"inputs": prompt, "parameters": CHAT_PARAMETERS},
+            API_URL_CHAT,
+            CHAT_BATCHER
         )
         
         if response_data and isinstance(response_data, list):
@@ -110,6 +815,8 @@ async def chat(payload: ChatRequest):
         else:
             reply = "I am not sure how to respond to that."
 
+        await save_chat_turn(payload, history, reply)
+
         return {"reply": reply}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -120,73 +827,48 @@ async def generate_smart_replies(payload: SmartReplyRequest):
     Generate contextual reply suggestions based on recent conversation.
     """
     try:
-        # Build conversation context (last 5-10 messages)
-        recent_context = []
-        for msg in payload.recent_messages[-10:]:  # Last 10 messages for context
-            recent_context.append(f"{msg['author']}: {msg['content']}")
-        
-        conversation_context = "\n".join(recent_context)
-        
-        # Create prompt for generating reply suggestions
-        prompt = f"""<|user|>
-Based on this conversation, suggest 3 short, appropriate replies that {payload.current_user} could send. 
-Make them natural, contextual, and varied in tone (e.g., one professional, one casual, one question).
-Each reply should be on a new line and be concise (under 20 words).
+        # Look up semantically similar conversations while generation runs
+        lookup_task = asyncio.create_task(semantic_cache_lookup(payload))
 
-Conversation:
-{conversation_context}
+        prompt = build_smart_reply_prompt(payload)
 
-Generate 3 reply suggestions for {payload.current_user}:</s>
-<|assistant|>"""
+        generate_task = asyncio.create_task(SMART_REPLY_BATCHER.submit(
+            {"inputs": prompt, "parameters": SMART_REPLY_PARAMETERS}
+        ))
 
-        response_data = query_huggingface(
-            {
-                "inputs": prompt,
-                "parameters": {
-                    "max_new_tokens": 100,
-                    "return_full_text": False,
-                    "temperature": 0.8,
-                    "top_p": 0.9,
-                    "do_sample": True
-                }
-            },
-            API_URL_CHAT
-        )
+        # A cache hit wins as soon as it arrives; otherwise wait for the generated replies
+        await asyncio.wait({lookup_task, generate_task}, return_when=asyncio.FIRST_COMPLETED)
+        if lookup_task.done():
+            # A failed lookup is only a cache miss; generation carries on
+            if lookup_task.exception() is not None:
+                print(f"Semantic cache lookup error: {lookup_task.exception()}")
+                cached = None
+            else:
+                _, cached = lookup_task.result()
+            if cached is not None:
+                generate_task.cancel()
+                return {"suggestions": cached[:payload.max_suggestions]}
+
+        response_data = await generate_task
         
         if response_data and isinstance(response_data, list):
             generated_text = response_data[0].get("generated_text", "").strip()
             
-            # Parse the suggestions (split by newlines and clean up)
-            suggestions = []
-            for line in generated_text.split('\n'):
-                line = line.strip()
-                # Clean up common prefixes
-                for prefix in ['1.', '2.', '3.', '-', '*', '•']:
-                    if line.startswith(prefix):
-                        line = line[len(prefix):].strip()
-                
-                if line and len(line) > 3 and len(line) < 100:  # Reasonable length
-                    suggestions.append(line)
-                    
-                if len(suggestions) >= payload.max_suggestions:
-                    break
+            suggestions = parse_suggestions(generated_text, MAX_SUGGESTIONS)
             
+            if suggestions:
+                # Warm the cache once the context embedding is available
+                def store_suggestions(task: asyncio.Task):
+                    if task.cancelled() or task.exception() is not None:
+                        return
+                    context_vector, _ = task.result()
+                    if context_vector is not None:
+                        SMART_REPLY_CACHE.add(context_vector, semantic_cache_owner(payload), suggestions)
+                lookup_task.add_done_callback(store_suggestions)
+
             # Fallback suggestions if AI didn't generate good ones
             if not suggestions:
-                # Analyze last message for context-aware fallbacks
-                last_message = payload.recent_messages[-1] if payload.recent_messages else None
-                if last_message:
-                    last_content = last_message['content'].lower()
-                    if '?' in last_content:
-                        suggestions = ["Thanks for asking!", "Let me think about that", "Good question!"]
-                    elif 'thanks' in last_content or 'thank you' in last_content:
-                        suggestions = ["You're welcome!", "No problem!", "Happy to help!"]
-                    elif 'meeting' in last_content:
-                        suggestions = ["Sounds good!", "I'll be there", "What time works?"]
-                    else:
-                        suggestions = ["Got it!", "Makes sense", "Thanks for the update"]
-                else:
-                    suggestions = ["Hi there!", "Thanks!", "Sounds good!"]
+                suggestions = fallback_suggestions(payload.recent_messages)
             
             return {"suggestions": suggestions[:payload.max_suggestions]}
             
@@ -199,6 +881,77 @@ Generate 3 reply suggestions for {payload.current_user}:</s>
         # Fallback suggestions on error
         return {"suggestions": ["Thanks!", "Got it!", "Let me check on that"]}
 
+@app.post("/api/v1/chat/stream", tags=["AI Features"])
+async def chat_stream(payload: ChatRequest):
+    """
+    Streams the conversational reply token by token as server-sent events.
+    """
+    history = await load_chat_history(payload)
+    prompt = build_chat_prompt(payload.text, history)
+
+    async def events():
+        reply_parts = []
+        try:
+            async for text in stream_huggingface({"inputs": prompt, "parameters": CHAT_PARAMETERS}, API_URL_CHAT):
+                reply_parts.append(text)
+                yield sse_event({"token": text})
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, event="error")
+            return
+
+        reply = "".join(reply_parts).strip()
+        await save_chat_turn(payload, history, reply)
+        yield sse_event({"reply": reply}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/api/v1/smart-replies/stream", tags=["AI Features"])
+async def generate_smart_replies_stream(payload: SmartReplyRequest):
+    """
+    Streams reply suggestions as server-sent events, one per suggestion as soon as its line is complete.
+    """
+    prompt = build_smart_reply_prompt(payload)
+
+    async def events():
+        sent = 0
+        buffer = ""
+        try:
+            async for text in stream_huggingface({"inputs": prompt, "parameters": SMART_REPLY_PARAMETERS}, API_URL_CHAT):
+                buffer += text
+                *lines, buffer = buffer.split("\n")
+                for suggestion in parse_suggestions("\n".join(lines), payload.max_suggestions - sent):
+                    sent += 1
+                    yield sse_event({"suggestion": suggestion})
+                if sent >= payload.max_suggestions:
+                    return
+            for suggestion in parse_suggestions(buffer, payload.max_suggestions - sent):
+                sent += 1
+                yield sse_event({"suggestion": suggestion})
+        except Exception as e:
+            print(f"Smart reply stream error: {e}")
+
+        # Fallback suggestions if AI didn't generate good ones
+        if not sent:
+            for suggestion in fallback_suggestions(payload.recent_messages)[:payload.max_suggestions]:
+                yield sse_event({"suggestion": suggestion})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.get("/", tags=["Health Check"])
 async def read_root():
-    return {"status": "AI Service is running"}
\ No newline at end of file
+    return {"status": "AI Service is running"}
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Each worker runs its own uvloop event loop with the httptools parser. Conversation history
+    # is only shared between workers through Redis, so without REDIS_URL a single worker is used.
+    default_workers = (os.cpu_count() or 1) if REDIS_URL else 1
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8001")),
+        workers=int(os.getenv("WEB_CONCURRENCY", default_workers)),
+        loop="uvloop",
+        http="httptools",
+    )
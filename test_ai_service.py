@@ -1,5 +1,6 @@
 import requests
 import json
+import uuid
 
 # The base URL for your running AI service
 BASE_URL = "http://127.0.0.1:8001"
@@ -8,6 +9,25 @@ def print_separator():
     """Prints a separator line for cleaner output."""
     print("\n" + "="*50 + "\n")
 
+def test_parse_suggestions():
+    """Tests suggestion parsing in main.py directly (no running service needed)."""
+    print("--- 0. Testing Suggestion Parsing ---")
+    
+    from main import parse_suggestions
+    
+    cases = [
+        ("1. Sure thing", ["Sure thing"]),
+        ("1. - Sure thing", ["Sure thing"]),
+        ("  * • Sounds good\n2. Will do!\n- ok", ["Sounds good", "Will do!"]),
+    ]
+    
+    for generated_text, expected in cases:
+        parsed = parse_suggestions(generated_text, 5)
+        if parsed == expected:
+            print(f"SUCCESS: {generated_text!r} -> {parsed}")
+        else:
+            print(f"ERROR: {generated_text!r} -> {parsed}, expected {expected}")
+
 def test_summarize_endpoint():
     """Tests the /api/v1/summarize endpoint."""
     print("--- 1. Testing Summarization Endpoint ---")
@@ -98,6 +118,124 @@ def test_chat_endpoint():
         print("\nERROR: Connection failed. Is the AI service running?")
 
 
+def test_chat_conversation_id_endpoint():
+    """Tests the /api/v1/chat endpoint with server-side history via conversation_id."""
+    print("--- 3. Testing Chat Endpoint (conversation_id) ---")
+    
+    url = f"{BASE_URL}/api/v1/chat"
+    conversation_id = f"test-conversation-{uuid.uuid4()}"
+    
+    try:
+        # --- Conversation Turn 1 ---
+        print("\nTurn 1:")
+        user_message_1 = "My favourite language is Python. Remember that."
+        print(f"User: '{user_message_1}'")
+        
+        response_1 = requests.post(url, json={"conversation_id": conversation_id, "text": user_message_1})
+        
+        if response_1.status_code != 200:
+            print(f"ERROR: Chat request failed.")
+            print(f"Status Code: {response_1.status_code}")
+            print(f"Response: {response_1.text}")
+            return # Stop the test if the first turn fails
+        
+        print(f"Bot: '{response_1.json()['reply']}'")
+        
+        # --- Conversation Turn 2 (history kept by the service) ---
+        print("\nTurn 2 (only conversation_id + text):")
+        user_message_2 = "Which language did I say was my favourite?"
+        print(f"User: '{user_message_2}'")
+        
+        response_2 = requests.post(url, json={"conversation_id": conversation_id, "text": user_message_2})
+        
+        if response_2.status_code == 200:
+            print("SUCCESS: Received chat reply using stored history.")
+            print(f"Bot: '{response_2.json()['reply']}'")
+        else:
+            print(f"ERROR: Chat request failed.")
+            print(f"Status Code: {response_2.status_code}")
+            print(f"Response: {response_2.text}")
+            
+    except requests.exceptions.ConnectionError:
+        print("\nERROR: Connection failed. Is the AI service running?")
+
+def read_sse_events(response):
+    """Yields (event, data) pairs from a server-sent events response."""
+    event = "message"
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            yield event, json.loads(line[len("data:"):].strip())
+            event = "message"
+
+def test_chat_stream_endpoint():
+    """Tests the /api/v1/chat/stream endpoint."""
+    print("--- 4. Testing Chat Streaming Endpoint ---")
+    
+    url = f"{BASE_URL}/api/v1/chat/stream"
+    user_message = "Give me one tip for writing clean Python code."
+    print(f"User: '{user_message}'")
+    
+    try:
+        with requests.post(url, json={"text": user_message}, stream=True) as response:
+            if response.status_code != 200:
+                print(f"\nERROR: Chat stream request failed.")
+                print(f"Status Code: {response.status_code}")
+                print(f"Response: {response.text}")
+                return
+            
+            tokens = 0
+            for event, data in read_sse_events(response):
+                if event == "error":
+                    print(f"\nERROR: Stream reported an error: {data['detail']}")
+                    return
+                if event == "done":
+                    print(f"\nSUCCESS: Received {tokens} streamed tokens.")
+                    print(f"Bot: '{data['reply']}'")
+                    return
+                tokens += 1
+            
+            print("\nERROR: Stream ended without a 'done' event.")
+            
+    except requests.exceptions.ConnectionError:
+        print("\nERROR: Connection failed. Is the AI service running?")
+
+def test_smart_replies_stream_endpoint():
+    """Tests the /api/v1/smart-replies/stream endpoint."""
+    print("--- 5. Testing Smart Replies Streaming Endpoint ---")
+    
+    url = f"{BASE_URL}/api/v1/smart-replies/stream"
+    payload = {
+        "recent_messages": [
+            {"author": "Alice", "content": "Are we still on for the meeting tomorrow?"},
+            {"author": "Bob", "content": "I think so, let me double check the time."},
+        ],
+        "current_user": "Alice",
+        "max_suggestions": 3
+    }
+    
+    try:
+        with requests.post(url, json=payload, stream=True) as response:
+            if response.status_code != 200:
+                print(f"\nERROR: Smart replies stream request failed.")
+                print(f"Status Code: {response.status_code}")
+                print(f"Response: {response.text}")
+                return
+            
+            suggestions = [data["suggestion"] for _, data in read_sse_events(response)]
+            
+            if suggestions:
+                print(f"SUCCESS: Received {len(suggestions)} streamed suggestions.")
+                for suggestion in suggestions:
+                    print(f"- '{suggestion}'")
+            else:
+                print("\nERROR: Stream ended without any suggestions.")
+            
+    except requests.exceptions.ConnectionError:
+        print("\nERROR: Connection failed. Is the AI service running?")
+
+
 if __name__ == "__main__":
     print("🚀 Starting AI Service Test Script 🚀")
     
@@ -112,8 +250,16 @@ if __name__ == "__main__":
         print("❌ FATAL: Could not connect to the AI Service.")
         print("Please ensure 'uvicorn main:app --reload --port 8001' is running.")
     
+    print_separator()
+    test_parse_suggestions()
     print_separator()
     test_summarize_endpoint()
     print_separator()
     test_chat_endpoint()
+    print_separator()
+    test_chat_conversation_id_endpoint()
+    print_separator()
+    test_chat_stream_endpoint()
+    print_separator()
+    test_smart_replies_stream_endpoint()
     print("\n✅ Test script finished.")
\ No newline at end of file